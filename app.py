@@ -5,10 +5,10 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import plotly.express as px
 import plotly.graph_objects as go
-from models import User, Review, ReviewCycle, ReviewAssignment, init_db
-from auth import authenticate_user, create_user, get_current_user
 import os
-import json
+from models import User, Review, ReviewCycle, ReviewAssignment, init_db
+from auth import authenticate_user, create_user, get_current_user, create_session, get_session_user, delete_session, SESSION_EXPIRE_DAYS
+import extra_streamlit_components as stx
 from reports import (
     get_department_scores,
     get_top_performers,
@@ -16,6 +16,7 @@ from reports import (
     get_training_recommendations,
     get_improvement_areas
 )
+from tags import get_tag_overrides, set_tag_override, delete_tag_override, clustering_pending
 
 # Configuration and styling
 st.set_page_config(
@@ -29,27 +30,6 @@ st.set_page_config(
 if "user" not in st.session_state:
     st.session_state.user = None
 
-# Session persistence
-def load_session():
-    try:
-        with open('.session.json', 'r') as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_session(session_data):
-    with open('.session.json', 'w') as f:
-        json.dump(session_data, f)
-
-# Load saved session if exists
-if 'user' not in st.session_state:
-    saved_session = load_session()
-    if 'user' in saved_session:
-        db = get_db()
-        user = db.query(User).filter(User.id == saved_session['user']['id']).first()
-        if user:
-            st.session_state.user = user
-
 # Header with logo and welcome message
 col1, col2, col3 = st.columns([1, 3, 1])
 with col1:
@@ -58,7 +38,7 @@ with col2:
     st.markdown("<h1 style='text-align: center; margin-top: 20px;'>Home Credit 360° Review</h1>", unsafe_allow_html=True)
 
 # Database setup
-DATABASE_URL = "sqlite:///360review.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///360review.db")
 engine = init_db(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -69,6 +49,24 @@ def get_db():
     finally:
         db.close()
 
+# Session persistence: the browser keeps only a random token in a cookie,
+# the session itself lives in the database so any replica can serve the user
+SESSION_COOKIE = "hc360_session"
+cookie_manager = stx.CookieManager(key="cookie_manager")
+
+if st.session_state.pop("clear_session_cookie", False):
+    cookie_manager.delete(SESSION_COOKIE)
+elif "pending_session_token" in st.session_state:
+    token, expires_at = st.session_state.pop("pending_session_token")
+    cookie_manager.set(SESSION_COOKIE, token, expires_at=expires_at)
+elif st.session_state.user is None:
+    session_token = cookie_manager.get(SESSION_COOKIE)
+    if session_token:
+        user = get_session_user(get_db(), session_token)
+        if user:
+            st.session_state.user = user
+            st.session_state.session_token = session_token
+
 def login_page():
     # Center the login form
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -94,13 +92,13 @@ def login_page():
                         if user:
                             st.session_state.user = user
                             if remember:
-                                save_session({
-                                    'user': {
-                                        'id': user.id,
-                                        'username': user.username,
-                                        'role': user.role
-                                    }
-                                })
+                                token = create_session(db, user.id)
+                                db.refresh(user)
+                                st.session_state.session_token = token
+                                # The cookie is written on the next run, after the rerun below
+                                st.session_state.pending_session_token = (
+                                    token, datetime.now() + timedelta(days=SESSION_EXPIRE_DAYS)
+                                )
                             st.experimental_rerun()
                         else:
                             st.error("Sai tên đăng nhập hoặc mật khẩu")
@@ -210,6 +208,9 @@ def hr_reports():
             }
         )
         st.plotly_chart(fig)
+    
+    if clustering_pending():
+        st.info("Đang chuẩn hóa các từ khóa mới, đề xuất và lĩnh vực ở trên tạm gộp theo cách viết. Tải lại trang sau ít phút để xem kết quả đầy đủ.")
 
 def admin_dashboard():
     # Dashboard header
@@ -223,7 +224,8 @@ def admin_dashboard():
     menu = {
         "Quản lý chu kỳ đánh giá": "📅",
         "Quản lý người dùng": "👥",
-        "Báo cáo HR": "📊"
+        "Báo cáo HR": "📊",
+        "Chuẩn hóa từ khóa": "🏷️"
     }
     
     choice = st.sidebar.selectbox(
@@ -241,6 +243,8 @@ def admin_dashboard():
         manage_users()
     elif choice == "Báo cáo HR":
         hr_reports()
+    elif choice == "Chuẩn hóa từ khóa":
+        manage_tag_overrides()
 
 def manager_dashboard():
     # Dashboard header
@@ -388,6 +392,45 @@ def manage_users():
     df = pd.DataFrame(users_data)
     st.dataframe(df)
 
+def manage_tag_overrides():
+    st.header("Chuẩn hóa đề xuất đào tạo và lĩnh vực cần cải thiện")
+    st.caption("Các cách viết gần giống nhau được gộp tự động. Dùng bảng dưới đây để chỉ định nhãn cho những trường hợp gộp sai hoặc chưa gộp.")
+    
+    # Form thêm ánh xạ
+    with st.form("new_tag_override"):
+        col1, col2 = st.columns(2)
+        with col1:
+            raw_tag = st.text_input("Từ khóa gốc", placeholder="VD: ky nang giao tiep")
+        with col2:
+            canonical = st.text_input("Nhãn chuẩn", placeholder="VD: Giao tiếp")
+        
+        if st.form_submit_button("Lưu"):
+            if raw_tag.strip() and canonical.strip():
+                db = get_db()
+                set_tag_override(db, raw_tag, canonical)
+                st.success("Đã lưu ánh xạ")
+            else:
+                st.error("Vui lòng điền đầy đủ thông tin")
+    
+    # Danh sách ánh xạ
+    db = get_db()
+    overrides = get_tag_overrides(db)
+    if not overrides:
+        st.info("Chưa có ánh xạ nào")
+        return
+    
+    df = pd.DataFrame(overrides).rename(columns={'raw_tag': 'Từ khóa gốc', 'canonical': 'Nhãn chuẩn'})
+    st.dataframe(df)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        to_delete = st.selectbox("Xóa ánh xạ", [o['raw_tag'] for o in overrides])
+    with col2:
+        if st.button("Xóa", key="delete_tag_override"):
+            delete_tag_override(db, to_delete)
+            st.success("Đã xóa ánh xạ")
+            st.experimental_rerun()
+
 def main():
     if st.session_state.user is None:
         login_page()
@@ -403,9 +446,11 @@ def main():
         
         if st.sidebar.button("📤 Đăng xuất", use_container_width=True):
             st.session_state.user = None
-            # Clear saved session
-            if os.path.exists('.session.json'):
-                os.remove('.session.json')
+            # Revoke the server-side session and drop the browser cookie
+            session_token = st.session_state.pop("session_token", None)
+            if session_token:
+                delete_session(get_db(), session_token)
+                st.session_state.clear_session_cookie = True
             st.experimental_rerun()
         
         st.sidebar.markdown("---")
@@ -1,14 +1,26 @@
 import os
+import time
+import hashlib
+import secrets
+import threading
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from models import User
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import User, UserSession
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY")  # Should be stored in environment variables
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Server-side sessions ("Ghi nhớ đăng nhập")
+SESSION_EXPIRE_DAYS = int(os.getenv("SESSION_EXPIRE_DAYS", "30"))
+SESSION_CACHE_SECONDS = int(os.getenv("SESSION_CACHE_SECONDS", "60"))
+SESSION_MISS_CACHE_SECONDS = 10  # how long an unknown/expired token is remembered
+SESSION_CACHE_MAX_ENTRIES = 10000
+SESSION_TOUCH_SECONDS = 300   # how often last_seen_at is written back
+SESSION_SWEEP_SECONDS = 3600  # how often expired rows are purged
+
 def verify_password(plain_password: str, stored_password: str) -> bool:
     return plain_password == stored_password
 
@@ -61,4 +73,117 @@ def get_current_user(db: Session, token: str):
     if username is None:
         return None
     user = db.query(User).filter(User.username == username).first()
-    return user 
\ No newline at end of file
+    return user 
+
+# Per-process cache: token_hash -> (user fields or None for a miss, expires_at, cached_at).
+# A session revoked on another replica stays valid here for at most SESSION_CACHE_SECONDS.
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+_last_sweep = None
+
+_USER_FIELDS = ('id', 'username', 'email', 'full_name', 'department', 'role', 'created_at')
+
+def _user_from_fields(fields: dict) -> User:
+    # Each caller gets its own detached copy, never an instance shared across sessions
+    user = User(**fields)
+    make_transient_to_detached(user)
+    return user
+
+def _cache_put(token_hash: str, fields, expires_at):
+    with _session_cache_lock:
+        _session_cache.pop(token_hash, None)
+        while len(_session_cache) >= SESSION_CACHE_MAX_ENTRIES:
+            _session_cache.pop(next(iter(_session_cache)))
+        _session_cache[token_hash] = (fields, expires_at, time.monotonic())
+
+def _evict_stale_cache_entries():
+    now = datetime.now()
+    cutoff = time.monotonic() - SESSION_CACHE_SECONDS
+    with _session_cache_lock:
+        stale = [
+            token_hash for token_hash, (fields, expires_at, cached_at) in _session_cache.items()
+            if cached_at < cutoff or (expires_at is not None and expires_at <= now)
+        ]
+        for token_hash in stale:
+            del _session_cache[token_hash]
+
+def hash_session_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def create_session(db: Session, user_id: int, expires_in: timedelta = None) -> str:
+    """Create a server-side session and return the raw token to hand to the browser"""
+    if expires_in is None:
+        expires_in = timedelta(days=SESSION_EXPIRE_DAYS)
+    token = secrets.token_urlsafe(32)
+    now = datetime.now()
+    db_session = UserSession(
+        token_hash=hash_session_token(token),
+        user_id=user_id,
+        expires_at=now + expires_in,
+        last_seen_at=now,
+        created_at=now
+    )
+    db.add(db_session)
+    db.commit()
+    return token
+
+def get_session_user(db: Session, token: str):
+    """Resolve a browser token to its user, or None if the session is unknown or expired"""
+    if not token:
+        return None
+    token_hash = hash_session_token(token)
+    now = datetime.now()
+
+    with _session_cache_lock:
+        cached = _session_cache.get(token_hash)
+    if cached:
+        fields, expires_at, cached_at = cached
+        age = time.monotonic() - cached_at
+        if fields is None and age < SESSION_MISS_CACHE_SECONDS:
+            return None
+        if fields is not None and expires_at > now and age < SESSION_CACHE_SECONDS:
+            return _user_from_fields(fields)
+        with _session_cache_lock:
+            _session_cache.pop(token_hash, None)
+
+    purge_expired_sessions(db)
+
+    db_session = db.query(UserSession).filter(UserSession.token_hash == token_hash).first()
+    if db_session is None or db_session.expires_at <= now:
+        _cache_put(token_hash, None, None)
+        return None
+
+    if db_session.last_seen_at is None or now - db_session.last_seen_at > timedelta(seconds=SESSION_TOUCH_SECONDS):
+        db_session.last_seen_at = now
+        db.commit()
+
+    user = db.query(User).filter(User.id == db_session.user_id).first()
+    if user is None:
+        _cache_put(token_hash, None, None)
+        return None
+    fields = {name: getattr(user, name) for name in _USER_FIELDS}
+    _cache_put(token_hash, fields, db_session.expires_at)
+    return _user_from_fields(fields)
+
+def delete_session(db: Session, token: str):
+    """Revoke a session (logout)"""
+    if not token:
+        return
+    token_hash = hash_session_token(token)
+    with _session_cache_lock:
+        _session_cache.pop(token_hash, None)
+    db.query(UserSession).filter(UserSession.token_hash == token_hash).delete(synchronize_session=False)
+    db.commit()
+
+def purge_expired_sessions(db: Session, force: bool = False) -> int:
+    """Delete expired sessions, at most once per SESSION_SWEEP_SECONDS unless forced"""
+    global _last_sweep
+    if not force and _last_sweep is not None and time.monotonic() - _last_sweep < SESSION_SWEEP_SECONDS:
+        return 0
+    _last_sweep = time.monotonic()
+    _evict_stale_cache_entries()
+    deleted = db.query(UserSession)\
+        .filter(UserSession.expires_at <= datetime.now())\
+        .delete(synchronize_session=False)
+    db.commit()
+    return deleted
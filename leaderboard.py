@@ -0,0 +1,288 @@
+import os
+from datetime import datetime
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy import event, func, and_, or_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import User, Review, LeaderboardEntry, LeaderboardState
+from typing import List, Dict, Any, Optional
+
+METRICS = ('performance', 'leadership', 'teamwork', 'innovation')
+
+# Trọng số mặc định: chỉ tính theo điểm hiệu suất (giống cách xếp hạng cũ)
+DEFAULT_WEIGHTS = {'performance': 1.0, 'leadership': 0.0, 'teamwork': 0.0, 'innovation': 0.0}
+
+def load_weights(spec: Optional[str] = None) -> Dict[str, float]:
+    """Đọc trọng số điểm tổng hợp, ví dụ "performance:0.4,leadership:0.2,teamwork:0.2,innovation:0.2" """
+    if spec is None:
+        spec = os.getenv("LEADERBOARD_WEIGHTS")
+    if not spec:
+        return dict(DEFAULT_WEIGHTS)
+
+    weights = {metric: 0.0 for metric in METRICS}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        metric, _, value = part.partition(':')
+        metric = metric.strip()
+        if metric not in weights:
+            raise ValueError(f"Tiêu chí không hợp lệ trong LEADERBOARD_WEIGHTS: {metric}")
+        weights[metric] = float(value)
+    return weights
+
+COMPOSITE_WEIGHTS = load_weights()
+
+def weights_fingerprint(weights: Optional[Dict[str, float]] = None) -> str:
+    """Chuỗi đại diện cho bộ trọng số, lưu cùng mỗi dòng để phát hiện khi công thức thay đổi"""
+    weights = weights or COMPOSITE_WEIGHTS
+    return ','.join(f"{metric}:{float(weights.get(metric, 0.0)):g}" for metric in METRICS)
+
+def composite_score(averages: Dict[str, Optional[float]], weights: Optional[Dict[str, float]] = None) -> float:
+    """Tính điểm tổng hợp theo trọng số, bỏ qua các tiêu chí chưa có điểm"""
+    weights = weights or COMPOSITE_WEIGHTS
+    total = 0.0
+    weight_sum = 0.0
+    for metric in METRICS:
+        value = averages.get(metric)
+        weight = weights.get(metric, 0.0)
+        if value is None or not weight:
+            continue
+        total += value * weight
+        weight_sum += weight
+    return total / weight_sum if weight_sum else 0.0
+
+def refresh_leaderboard_entry(db: Session, review_cycle_id: int, reviewee_id: int) -> Optional[LeaderboardEntry]:
+    """Tính lại điểm của một nhân viên trong một kỳ đánh giá (không commit)"""
+    r = db.query(
+        func.avg(Review.performance_score).label('avg_performance'),
+        func.avg(Review.leadership_score).label('avg_leadership'),
+        func.avg(Review.teamwork_score).label('avg_teamwork'),
+        func.avg(Review.innovation_score).label('avg_innovation'),
+        func.count(Review.id).label('review_count')
+    ).filter(Review.review_cycle_id == review_cycle_id)\
+    .filter(Review.reviewee_id == reviewee_id)\
+    .one()
+
+    entry = db.query(LeaderboardEntry)\
+        .filter_by(review_cycle_id=review_cycle_id, reviewee_id=reviewee_id)\
+        .first()
+
+    if not r.review_count:
+        if entry:
+            db.delete(entry)
+        return None
+
+    if entry is None:
+        entry = LeaderboardEntry(review_cycle_id=review_cycle_id, reviewee_id=reviewee_id)
+        db.add(entry)
+
+    averages = {
+        'performance': r.avg_performance,
+        'leadership': r.avg_leadership,
+        'teamwork': r.avg_teamwork,
+        'innovation': r.avg_innovation
+    }
+    entry.department = db.query(User.department).filter(User.id == reviewee_id).scalar()
+    entry.avg_performance = r.avg_performance
+    entry.avg_leadership = r.avg_leadership
+    entry.avg_teamwork = r.avg_teamwork
+    entry.avg_innovation = r.avg_innovation
+    entry.review_count = r.review_count
+    entry.composite_score = composite_score(averages)
+    return entry
+
+def rebuild_leaderboard(db: Session, review_cycle_id: int) -> int:
+    """Dựng lại toàn bộ bảng xếp hạng của một kỳ đánh giá theo LEADERBOARD_WEIGHTS, ví dụ sau khi ghi hàng loạt"""
+    results = db.query(
+        Review.reviewee_id,
+        User.department,
+        func.avg(Review.performance_score).label('avg_performance'),
+        func.avg(Review.leadership_score).label('avg_leadership'),
+        func.avg(Review.teamwork_score).label('avg_teamwork'),
+        func.avg(Review.innovation_score).label('avg_innovation'),
+        func.count(Review.id).label('review_count')
+    ).join(User, Review.reviewee_id == User.id)\
+    .filter(Review.review_cycle_id == review_cycle_id)\
+    .group_by(Review.reviewee_id, User.department)\
+    .all()
+
+    db.query(LeaderboardEntry)\
+        .filter(LeaderboardEntry.review_cycle_id == review_cycle_id)\
+        .delete(synchronize_session=False)
+
+    now = datetime.now()
+    db.add_all([
+        LeaderboardEntry(
+            review_cycle_id=review_cycle_id,
+            reviewee_id=r.reviewee_id,
+            department=r.department,
+            avg_performance=r.avg_performance,
+            avg_leadership=r.avg_leadership,
+            avg_teamwork=r.avg_teamwork,
+            avg_innovation=r.avg_innovation,
+            review_count=r.review_count,
+            composite_score=composite_score({
+                'performance': r.avg_performance,
+                'leadership': r.avg_leadership,
+                'teamwork': r.avg_teamwork,
+                'innovation': r.avg_innovation
+            }),
+            updated_at=now
+        )
+        for r in results
+    ])
+
+    state = db.query(LeaderboardState).filter_by(review_cycle_id=review_cycle_id).first()
+    if state is None:
+        state = LeaderboardState(review_cycle_id=review_cycle_id)
+        db.add(state)
+    state.weights_key = weights_fingerprint()
+    state.is_stale = False
+    state.rebuilt_at = now
+    db.commit()
+    return len(results)
+
+def submit_review(db: Session, review: Review) -> Review:
+    """Nộp đánh giá; bảng xếp hạng được cập nhật qua hook flush bên dưới"""
+    review.status = 'submitted'
+    review.submitted_at = datetime.now()
+    db.commit()
+    db.refresh(review)
+    return review
+
+# Mọi thay đổi Review qua ORM (thêm, sửa, xóa) đều cập nhật dòng bảng xếp hạng tương ứng
+# trong cùng transaction; nhân viên đổi phòng ban thì phòng ban trên các dòng của họ đổi theo.
+# Câu lệnh hàng loạt qua Session (query.update/delete, session.execute(insert/update/delete))
+# đánh dấu mọi kỳ cần dựng lại. bulk_insert_mappings/bulk_update_mappings và SQL thô không đi
+# qua hook nào: sau đó cần gọi rebuild_leaderboard.
+_DIRTY_KEY = 'leaderboard_dirty'
+_MOVED_KEY = 'leaderboard_moved'
+
+def _review_keys(review: Review):
+    cycle_ids = {review.review_cycle_id} | set(attributes.get_history(review, 'review_cycle_id').deleted)
+    reviewee_ids = {review.reviewee_id} | set(attributes.get_history(review, 'reviewee_id').deleted)
+    return {(c, r) for c in cycle_ids for r in reviewee_ids if c is not None and r is not None}
+
+@event.listens_for(Session, 'before_flush')
+def _collect_dirty_reviews(session, flush_context, instances):
+    dirty = session.info.setdefault(_DIRTY_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Review):
+            dirty |= _review_keys(obj)
+    moved = session.info.setdefault(_MOVED_KEY, set())
+    for obj in session.dirty:
+        if isinstance(obj, User) and attributes.get_history(obj, 'department').has_changes():
+            moved.add(obj.id)
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_dirty_entries(session, flush_context):
+    dirty = session.info.pop(_DIRTY_KEY, None)
+    moved = session.info.pop(_MOVED_KEY, None)
+    with session.no_autoflush:
+        for review_cycle_id, reviewee_id in dirty or ():
+            refresh_leaderboard_entry(session, review_cycle_id, reviewee_id)
+        for user_id in moved or ():
+            department = session.query(User.department).filter(User.id == user_id).scalar()
+            session.query(LeaderboardEntry)\
+                .filter(LeaderboardEntry.reviewee_id == user_id)\
+                .update({LeaderboardEntry.department: department}, synchronize_session=False)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_bulk_writes(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    classes = {mapper.class_ for mapper in orm_execute_state.all_mappers}
+    # Không biết câu lệnh chạm tới kỳ nào nên đánh dấu tất cả; số kỳ đánh giá nhỏ
+    if Review in classes or (User in classes and not orm_execute_state.is_insert):
+        orm_execute_state.session.execute(update(LeaderboardState).values(is_stale=True))
+
+def is_leaderboard_stale(db: Session, review_cycle_id: int) -> bool:
+    """Kỳ đánh giá chưa được dựng, bị đánh dấu cần dựng lại, hoặc được tính với trọng số khác"""
+    state = db.query(LeaderboardState.weights_key, LeaderboardState.is_stale)\
+        .filter(LeaderboardState.review_cycle_id == review_cycle_id)\
+        .first()
+    return state is None or bool(state.is_stale) or state.weights_key != weights_fingerprint()
+
+def _ensure_leaderboard(db: Session, review_cycle_id: int):
+    if not is_leaderboard_stale(db, review_cycle_id):
+        return
+    try:
+        rebuild_leaderboard(db, review_cycle_id)
+    except (IntegrityError, OperationalError):
+        # Một bản app khác đang dựng lại cùng kỳ (trùng uq_leaderboard_cycle_reviewee, deadlock,
+        # CSDL đang khóa): bỏ lần dựng này và đọc kết quả của bản kia
+        db.rollback()
+
+def _entry_to_dict(entry: LeaderboardEntry, full_name: str, rank: int) -> Dict[str, Any]:
+    return {
+        'rank': rank,
+        'reviewee_id': entry.reviewee_id,
+        'full_name': full_name,
+        'department': entry.department,
+        'composite_score': float(entry.composite_score or 0),
+        'avg_performance': float(entry.avg_performance or 0),
+        'avg_leadership': float(entry.avg_leadership or 0),
+        'avg_teamwork': float(entry.avg_teamwork or 0),
+        'avg_innovation': float(entry.avg_innovation or 0),
+        'review_count': entry.review_count
+    }
+
+def get_leaderboard(db: Session, review_cycle_id: int, limit: int = 10, offset: int = 0,
+                    department: Optional[str] = None, ascending: bool = False) -> List[Dict[str, Any]]:
+    """Lấy một trang bảng xếp hạng (top-N, bottom-N hoặc phân trang), có thể lọc theo phòng ban"""
+    _ensure_leaderboard(db, review_cycle_id)
+
+    query = db.query(LeaderboardEntry, User.full_name)\
+        .join(User, LeaderboardEntry.reviewee_id == User.id)\
+        .filter(LeaderboardEntry.review_cycle_id == review_cycle_id)
+    if department is not None:
+        query = query.filter(LeaderboardEntry.department == department)
+
+    if ascending:
+        query = query.order_by(LeaderboardEntry.composite_score.asc(), LeaderboardEntry.reviewee_id.desc())
+    else:
+        query = query.order_by(LeaderboardEntry.composite_score.desc(), LeaderboardEntry.reviewee_id.asc())
+
+    results = query.offset(offset).limit(limit).all()
+
+    if ascending:
+        total = count_leaderboard(db, review_cycle_id, department)
+        return [
+            _entry_to_dict(entry, full_name, total - offset - i)
+            for i, (entry, full_name) in enumerate(results)
+        ]
+    return [
+        _entry_to_dict(entry, full_name, offset + i + 1)
+        for i, (entry, full_name) in enumerate(results)
+    ]
+
+def count_leaderboard(db: Session, review_cycle_id: int, department: Optional[str] = None) -> int:
+    """Số nhân viên có trong bảng xếp hạng"""
+    query = db.query(func.count(LeaderboardEntry.id))\
+        .filter(LeaderboardEntry.review_cycle_id == review_cycle_id)
+    if department is not None:
+        query = query.filter(LeaderboardEntry.department == department)
+    return query.scalar()
+
+def get_rank(db: Session, review_cycle_id: int, reviewee_id: int,
+             department: Optional[str] = None) -> Optional[int]:
+    """Thứ hạng của một nhân viên (1 là cao nhất), None nếu chưa có điểm"""
+    _ensure_leaderboard(db, review_cycle_id)
+
+    entry = db.query(LeaderboardEntry)\
+        .filter_by(review_cycle_id=review_cycle_id, reviewee_id=reviewee_id)\
+        .first()
+    if entry is None:
+        return None
+    if department is not None and entry.department != department:
+        return None
+
+    query = db.query(func.count(LeaderboardEntry.id))\
+        .filter(LeaderboardEntry.review_cycle_id == review_cycle_id)\
+        .filter(or_(
+            LeaderboardEntry.composite_score > entry.composite_score,
+            and_(LeaderboardEntry.composite_score == entry.composite_score,
+                 LeaderboardEntry.reviewee_id < entry.reviewee_id)
+        ))
+    if department is not None:
+        query = query.filter(LeaderboardEntry.department == department)
+    return query.scalar() + 1
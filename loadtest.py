@@ -0,0 +1,457 @@
+"""Load harness: chạy các trang Streamlit thật (qua streamlit.testing AppTest) từ nhiều phiên đồng thời.
+
+AppTest thay đổi trạng thái toàn cục của streamlit trong mỗi lần chạy nên không chạy
+song song bằng thread được. Vì vậy tải được chia cho nhiều tiến trình (tương tự nhiều
+bản app.py sau load balancer). Trong mỗi tiến trình các phiên chạy lần lượt (xen kẽ
+từng thao tác), nên số lượt chạy đồng thời thực tế bằng số tiến trình chứ không phải
+số phiên. --sessions chỉ là số người dùng ảo: chỉ phiên admin giữ trạng thái giữa các thao
+tác, mỗi lượt đăng nhập của nhân viên dùng một AppTest mới, nên tăng --sessions mà giữ
+--processes chỉ thêm lượt chạy tuần tự. Muốn N người dùng mở app cùng lúc thì cần
+--processes N, mỗi tiến trình khoảng 195 MB RSS.
+
+Một lượt chỉ tính là thành công khi trang đích thực sự hiển thị: đăng nhập phải tới
+được dashboard (có nút "📤 Đăng xuất"), kích hoạt phải đổi được trạng thái kỳ đánh giá.
+
+Ví dụ:
+    python loadtest.py --sessions 64 --processes 64 --iterations 5 --scenario start_of_cycle
+    python loadtest.py --mix login=0.5,hr_reports=0.5 --employees 2000 --json result.json
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import tempfile
+import multiprocessing
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, User, Review, ReviewCycle
+from leaderboard import rebuild_leaderboard
+from typing import List, Dict, Any, Optional
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = "admin123"
+EMPLOYEE_PASSWORD = "password"
+# Nút chỉ có trên sidebar khi đã vào dashboard
+LOGOUT_LABEL = "📤 Đăng xuất"
+
+DEPARTMENTS = ["HR", "IT", "Sales", "Finance", "Operations", "Risk", "Marketing", "Collections"]
+TAGS = ["Giao tiếp", "giao tiep", "Kỹ năng giao tiếp", "Quản lý thời gian", "quan ly thoi gian",
+        "Excel", "excel nâng cao", "Lãnh đạo", "Kỹ năng lãnh đạo", "Đàm phán", "Thuyết trình",
+        "Làm việc nhóm", "Quản lý dự án", "Tiếng Anh", "tieng anh giao tiep", "Phân tích dữ liệu"]
+
+# Tỷ lệ các thao tác trong mỗi kịch bản
+SCENARIOS = {
+    # Đầu kỳ: phần lớn nhân viên đăng nhập cùng lúc, HR theo dõi báo cáo
+    "start_of_cycle": {"login": 0.7, "hr_reports": 0.15, "manage_users": 0.1, "activate_cycle": 0.05},
+    # Cuối kỳ: HR và quản trị xem báo cáo nhiều
+    "reporting": {"login": 0.2, "hr_reports": 0.6, "manage_users": 0.2},
+    "login_only": {"login": 1.0},
+}
+
+# Lượt chạy phụ để tới được trang của thao tác (mở form đăng nhập, mở trang quản lý kỳ):
+# vẫn đo độ trễ nhưng không tính vào throughput của kịch bản
+HELPER_ACTIONS = ("login_page", "manage_review_cycles")
+
+ADMIN_PAGES = {
+    "hr_reports": "Báo cáo HR",
+    "manage_users": "Quản lý người dùng",
+    "activate_cycle": "Quản lý chu kỳ đánh giá",
+}
+
+def generate_database(path: str, employees: int = 300, reviews_per_employee: int = 5,
+                      draft_cycles: int = 20, seed: int = 42) -> str:
+    """Tạo CSDL SQLite với nhân viên, một kỳ đánh giá đang chạy và các kỳ nháp để kích hoạt"""
+    rng = random.Random(seed)
+    database_url = f"sqlite:///{path}"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+
+    now = datetime.now()
+    users = [{
+        'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD, 'email': 'admin@homecredit.vn',
+        'full_name': 'Admin', 'department': 'HR', 'role': 'admin', 'created_at': now
+    }]
+    for i in range(employees):
+        users.append({
+            'username': f"emp{i}", 'password': EMPLOYEE_PASSWORD, 'email': f"emp{i}@homecredit.vn",
+            'full_name': f"Nhân viên {i}", 'department': rng.choice(DEPARTMENTS),
+            'role': 'manager' if i % 10 == 0 else 'employee', 'created_at': now
+        })
+    db.bulk_insert_mappings(User, users)
+    db.commit()
+
+    admin_id = db.query(User.id).filter(User.username == ADMIN_USERNAME).scalar()
+    employee_ids = [uid for (uid,) in db.query(User.id).filter(User.role != 'admin').all()]
+
+    active = ReviewCycle(name="Kỳ đánh giá hiện tại", start_date=now - timedelta(days=7),
+                         end_date=now + timedelta(days=21), status="active", created_by=admin_id)
+    db.add(active)
+    db.add_all([
+        ReviewCycle(name=f"Kỳ nháp {i}", start_date=now, end_date=now + timedelta(days=30),
+                    status="draft", created_by=admin_id)
+        for i in range(draft_cycles)
+    ])
+    db.commit()
+
+    reviews = []
+    for reviewee_id in employee_ids:
+        for _ in range(reviews_per_employee):
+            reviews.append({
+                'review_cycle_id': active.id,
+                'reviewer_id': rng.choice(employee_ids),
+                'reviewee_id': reviewee_id,
+                'relationship_type': rng.choice(['peer', 'superior', 'subordinate']),
+                'performance_score': rng.uniform(1, 5),
+                'leadership_score': rng.uniform(1, 5),
+                'teamwork_score': rng.uniform(1, 5),
+                'innovation_score': rng.uniform(1, 5),
+                'areas_for_improvement': ", ".join(rng.sample(TAGS, 2)),
+                'training_recommendations': ", ".join(rng.sample(TAGS, 2)),
+                'status': 'submitted',
+                'submitted_at': now
+            })
+    db.bulk_insert_mappings(Review, reviews)
+    db.commit()
+    rebuild_leaderboard(db, active.id)
+    db.close()
+    return database_url
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Đọc tỷ lệ thao tác dạng "login=0.7,hr_reports=0.3" """
+    weights = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        action, _, weight = part.partition('=')
+        action = action.strip()
+        if action != "login" and action not in ADMIN_PAGES:
+            raise ValueError(f"Thao tác không hợp lệ: {action}")
+        weights[action] = float(weight)
+    return weights
+
+def draft_cycles_needed(weights: Dict[str, float], sessions: int, iterations: int) -> int:
+    """Số kỳ nháp cần tạo: số lượt kích hoạt kỳ vọng cộng 3 độ lệch chuẩn.
+
+    Trang quản lý kỳ đánh giá và selectbox của báo cáo HR hiển thị mọi kỳ, nên số kỳ
+    phải bám theo số lượt kích hoạt thật chứ không theo sessions × iterations; nếu vẫn
+    hết kỳ nháp thì lượt đó được tính vào "bỏ qua".
+    """
+    total = sum(weights.values())
+    share = weights.get("activate_cycle", 0.0) / total if total else 0.0
+    runs = sessions * iterations
+    if not share:
+        return 1
+    expected = runs * share
+    return math.ceil(expected + 3 * math.sqrt(expected * (1 - share))) + 1
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+def _is_lock_error(message: str) -> bool:
+    return "database is locked" in message or "database table is locked" in message
+
+def _select(selectbox, label: str):
+    # AppTest (streamlit 1.28) so khớp giá trị với options đã qua format_func,
+    # nên chọn theo chỉ số của option hiển thị ("📊 Báo cáo HR")
+    for i, option in enumerate(selectbox.options):
+        if option == label or option.endswith(" " + label):
+            return selectbox.select_index(i)
+    raise ValueError(f"Không có lựa chọn {label!r} trong {selectbox.label!r}")
+
+def _pin_selectboxes(at):
+    for selectbox in at.selectbox:
+        try:
+            selectbox.index
+        except ValueError:
+            _select(selectbox, str(selectbox.value))
+
+class Recorder:
+    """Số liệu của các phiên trong một tiến trình"""
+
+    def __init__(self):
+        self.latencies = {}  # action -> [seconds]
+        self.errors = {}  # action -> count
+        self.lock_errors = 0
+        self.skipped = 0
+        self.messages = Counter()  # first line of each error message -> count
+
+    def run(self, action: str, at, timeout: float, follow_rerun: bool = False):
+        """Chạy lại script, ghi thời gian và lỗi; trả về False nếu lần chạy thất bại.
+
+        AppTest (streamlit 1.28) trả về ngay khi script gọi st.experimental_rerun, nên với
+        các thao tác có rerun (follow_rerun=True) phải chạy thêm một lần để có trang kết quả.
+        """
+        start = time.perf_counter()
+        messages = self._run_once(at, timeout)
+        if follow_rerun and not messages:
+            messages = self._run_once(at, timeout)
+        elapsed = time.perf_counter() - start
+
+        self.latencies.setdefault(action, []).append(elapsed)
+        if messages:
+            self.errors[action] = self.errors.get(action, 0) + 1
+            self.lock_errors += sum(1 for m in messages if _is_lock_error(m))
+            self.messages.update(m.strip().splitlines()[0][:200] for m in messages if m.strip())
+        return not messages
+
+    def fail(self, action: str, message: str):
+        """Ghi lỗi cho một lượt chạy không có exception nhưng không tới được trang mong đợi"""
+        self.errors[action] = self.errors.get(action, 0) + 1
+        self.messages[message] += 1
+
+    def _run_once(self, at, timeout: float) -> List[str]:
+        _pin_selectboxes(at)
+        try:
+            at.run(timeout=timeout)
+        except KeyError as ex:
+            # AppTest đọc query string từ sự kiện cuối trong khi rerun vẫn đang chạy;
+            # đây là lỗi của công cụ kiểm thử, không phải của ứng dụng
+            if ex.args != ('client_state',):
+                return [f"KeyError: {ex}"]
+        except Exception as ex:  # timeout hoặc lỗi của AppTest
+            return [f"{type(ex).__name__}: {ex}"]
+        return [e.message for e in at.exception]
+
+class SimulatedSession:
+    """Một người dùng ảo: một phiên admin đã đăng nhập và các lượt đăng nhập của nhân viên"""
+
+    def __init__(self, recorder: Recorder, employees: int, timeout: float, rng: random.Random):
+        from streamlit.testing.v1 import AppTest
+        self.AppTest = AppTest
+        self.recorder = recorder
+        self.employees = employees
+        self.timeout = timeout
+        self.rng = rng
+        self.admin = None
+
+    def _login(self, username: str, password: str, remember: bool):
+        at = self.AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        if not self.recorder.run("login_page", at, self.timeout):
+            return None
+        at.text_input[0].input(username)
+        at.text_input[1].input(password)
+        if remember:
+            at.checkbox[0].check()
+        at.button[0].click()
+        if not self.recorder.run("login", at, self.timeout, follow_rerun=True):
+            return None
+        if not any(b.label == LOGOUT_LABEL for b in at.button):
+            self.recorder.fail("login", "Đăng nhập không vào được dashboard")
+            return None
+        return at
+
+    def login(self):
+        username = f"emp{self.rng.randrange(self.employees)}"
+        self._login(username, EMPLOYEE_PASSWORD, remember=self.rng.random() < 0.5)
+
+    def admin_page(self, action: str):
+        if self.admin is None:
+            self.admin = self._login(ADMIN_USERNAME, ADMIN_PASSWORD, remember=False)
+            if self.admin is None:
+                return
+        menu = next(s for s in self.admin.selectbox if s.label == "Chức năng")
+        _select(menu, ADMIN_PAGES[action])
+
+        if action != "activate_cycle":
+            self.recorder.run(action, self.admin, self.timeout)
+            return
+
+        if not self.recorder.run("manage_review_cycles", self.admin, self.timeout):
+            return
+        buttons = [b for b in self.admin.button if b.label == "Kích hoạt"]
+        if not buttons:
+            self.recorder.skipped += 1
+            return
+        cycle_id = buttons[0].key[len("activate_"):]
+        buttons[0].click()
+        if not self.recorder.run(action, self.admin, self.timeout, follow_rerun=True):
+            return
+        if not any(b.key == f"complete_{cycle_id}" for b in self.admin.button):
+            self.recorder.fail(action, "Kỳ đánh giá không được kích hoạt")
+
+    def step(self, action: str):
+        if action == "login":
+            self.login()
+        else:
+            self.admin_page(action)
+
+_start_barrier = None
+
+def _init_worker(barrier, database_url: str):
+    global _start_barrier
+    _start_barrier = barrier
+    os.environ["DATABASE_URL"] = database_url
+
+def _run_worker(worker_index: int, sessions: int, iterations: int, weights: Dict[str, float],
+                employees: int, timeout: float, seed: int, trace_memory: bool) -> Dict[str, Any]:
+    rng = random.Random(seed * 100003 + worker_index)
+    recorder = Recorder()
+    simulated = [SimulatedSession(recorder, employees, timeout, rng) for _ in range(sessions)]
+    actions = list(weights)
+    action_weights = [weights[a] for a in actions]
+
+    if trace_memory:
+        tracemalloc.start()
+    _start_barrier.wait()  # mọi tiến trình bắt đầu cùng lúc, như đầu kỳ đánh giá
+    for _ in range(iterations):
+        for session in simulated:
+            session.step(rng.choices(actions, action_weights)[0])
+
+    return {
+        'latencies': recorder.latencies,
+        'errors': recorder.errors,
+        'lock_errors': recorder.lock_errors,
+        'skipped': recorder.skipped,
+        'messages': recorder.messages,
+        'peak_rss_mb': _peak_rss_mb(),
+        'traced_peak_mb': tracemalloc.get_traced_memory()[1] / 1024 / 1024 if trace_memory else None
+    }
+
+def run_load(database_url: str, weights: Dict[str, float], sessions: int, iterations: int,
+             employees: int, processes: int = 4, timeout: float = 60, seed: int = 0,
+             trace_memory: bool = False) -> Dict[str, Any]:
+    """Chạy `sessions` phiên trên `processes` tiến trình, mỗi phiên `iterations` thao tác theo tỷ lệ `weights`.
+
+    Số lượt chạy đồng thời thực tế là `processes` (báo cáo ở 'effective_concurrency').
+    """
+    processes = max(1, min(processes, sessions))
+    per_process = [sessions // processes + (1 if i < sessions % processes else 0) for i in range(processes)]
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(processes)
+    start = time.perf_counter()
+    # Pool khởi động đủ tiến trình ngay từ đầu, mỗi tiến trình nhận đúng một phần việc
+    with ctx.Pool(processes, initializer=_init_worker, initargs=(barrier, database_url)) as pool:
+        workers = pool.starmap(_run_worker, [
+            (i, per_process[i], iterations, weights, employees, timeout, seed, trace_memory)
+            for i in range(processes)
+        ], chunksize=1)
+    wall_time = time.perf_counter() - start
+
+    latencies = {}
+    errors = {}
+    messages = Counter()
+    for worker in workers:
+        messages.update(worker['messages'])
+        for action, values in worker['latencies'].items():
+            latencies.setdefault(action, []).extend(values)
+        for action, count in worker['errors'].items():
+            errors[action] = errors.get(action, 0) + count
+
+    rss = [w['peak_rss_mb'] for w in workers if w['peak_rss_mb'] is not None]
+    traced = [w['traced_peak_mb'] for w in workers if w['traced_peak_mb'] is not None]
+    total = sum(len(v) for v in latencies.values())
+    helper_runs = sum(len(v) for action, v in latencies.items() if action in HELPER_ACTIONS)
+    scenario_runs = total - helper_runs
+    return {
+        'sessions': sessions,
+        'processes': processes,
+        'effective_concurrency': processes,
+        'iterations': iterations,
+        'weights': weights,
+        'wall_time': wall_time,
+        'total_runs': total,
+        'scenario_runs': scenario_runs,
+        'helper_runs': helper_runs,
+        'throughput': scenario_runs / wall_time if wall_time else 0.0,
+        'helper_throughput': helper_runs / wall_time if wall_time else 0.0,
+        'lock_errors': sum(w['lock_errors'] for w in workers),
+        'skipped': sum(w['skipped'] for w in workers),
+        'top_errors': messages.most_common(5),
+        'peak_rss_mb': max(rss) if rss else None,
+        'total_peak_rss_mb': sum(rss) if rss else None,
+        'traced_peak_mb': max(traced) if traced else None,
+        'pages': {
+            action: {
+                'count': len(values),
+                'errors': errors.get(action, 0),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': max(values)
+            }
+            for action, values in sorted(latencies.items())
+        }
+    }
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def print_report(result: Dict[str, Any]):
+    print(f"Phiên: {result['sessions']} trên {result['processes']} tiến trình, thao tác/phiên: {result['iterations']}, "
+          f"tỷ lệ: {result['weights']}")
+    print(f"Số lượt chạy đồng thời thực tế: {result['effective_concurrency']} "
+          f"(mỗi tiến trình chạy lần lượt {result['sessions'] / result['processes']:.1f} phiên)")
+    print(f"{'Trang':<22}{'Số lần':>8}{'Lỗi':>6}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for action, stats in result['pages'].items():
+        print(f"{action:<22}{stats['count']:>8}{stats['errors']:>6}"
+              f"{stats['p50']:>9.3f}{stats['p90']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+    print(f"Thời gian: {result['wall_time']:.1f}s, throughput: {result['throughput']:.2f} thao tác/s "
+          f"(không tính {result['helper_runs']} lượt phụ {', '.join(HELPER_ACTIONS)}: {result['helper_throughput']:.2f} lượt/s)")
+    print(f"Lỗi khóa CSDL: {result['lock_errors']}, bỏ qua (hết kỳ nháp): {result['skipped']}")
+    for message, count in result['top_errors']:
+        print(f"  {count} x {message}")
+    if result['peak_rss_mb'] is not None:
+        print(f"Bộ nhớ đỉnh (RSS): {result['peak_rss_mb']:.1f} MB/tiến trình, "
+              f"tổng {result['total_peak_rss_mb']:.1f} MB")
+        if result['sessions'] > result['processes']:
+            print(f"Muốn {result['sessions']} phiên chạy đồng thời thật cần --processes {result['sessions']} "
+                  f"(khoảng {result['sessions'] * result['peak_rss_mb'] / 1024:.1f} GB RSS)")
+    if result['traced_peak_mb'] is not None:
+        print(f"Bộ nhớ đỉnh (tracemalloc): {result['traced_peak_mb']:.1f} MB/tiến trình")
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm thử tải các trang Streamlit của app.py")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="start_of_cycle")
+    parser.add_argument("--mix", help='tỷ lệ tự chọn, ví dụ "login=0.7,hr_reports=0.3" (thay cho --scenario)')
+    parser.add_argument("--sessions", type=int, default=20, help="số người dùng ảo, chia đều cho các tiến trình và chạy tuần tự trong mỗi tiến trình")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 4, help="số tiến trình chạy song song = số phiên đồng thời thực tế (~195 MB RSS mỗi tiến trình)")
+    parser.add_argument("--iterations", type=int, default=5, help="số thao tác mỗi phiên")
+    parser.add_argument("--employees", type=int, default=300)
+    parser.add_argument("--reviews-per-employee", type=int, default=5)
+    parser.add_argument("--db", help="đường dẫn file SQLite sinh ra (mặc định: thư mục tạm)")
+    parser.add_argument("--timeout", type=float, default=60, help="thời gian tối đa mỗi lượt chạy (giây)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="đo thêm bộ nhớ bằng tracemalloc (chậm hơn)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix) if args.mix else SCENARIOS[args.scenario]
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="hc360-load-"), "loadtest.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    draft_cycles = draft_cycles_needed(weights, args.sessions, args.iterations)
+    database_url = generate_database(db_path, args.employees, args.reviews_per_employee,
+                                     draft_cycles=draft_cycles, seed=args.seed)
+    print(f"CSDL: {db_path} ({args.employees} nhân viên, {draft_cycles} kỳ nháp)")
+
+    result = run_load(database_url, weights, args.sessions, args.iterations, args.employees,
+                      processes=args.processes, timeout=args.timeout, seed=args.seed, trace_memory=args.trace_memory)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
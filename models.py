@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Float, Text, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Float, Text, Boolean, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -61,6 +61,10 @@ class Review(Base):
     review_cycle = relationship('ReviewCycle', back_populates='reviews')
     reviewer = relationship('User', back_populates='reviews_given', foreign_keys=[reviewer_id])
     reviewee = relationship('User', back_populates='reviews_received', foreign_keys=[reviewee_id])
+    
+    __table_args__ = (
+        Index('ix_reviews_cycle_reviewee', 'review_cycle_id', 'reviewee_id'),
+    )
 
 class ReviewAssignment(Base):
     __tablename__ = 'review_assignments'
@@ -74,6 +78,65 @@ class ReviewAssignment(Base):
     due_date = Column(DateTime)
     created_at = Column(DateTime, default=datetime.now)
 
+class LeaderboardEntry(Base):
+    __tablename__ = 'leaderboard_entries'
+    
+    id = Column(Integer, primary_key=True)
+    review_cycle_id = Column(Integer, ForeignKey('review_cycles.id'), nullable=False)
+    reviewee_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    department = Column(String(100))  # copied from users.department for filtered rankings
+    
+    # Per-metric averages over the reviewee's reviews in the cycle
+    avg_performance = Column(Float)
+    avg_leadership = Column(Float)
+    avg_teamwork = Column(Float)
+    avg_innovation = Column(Float)
+    review_count = Column(Integer, default=0)
+    
+    composite_score = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    reviewee = relationship('User', foreign_keys=[reviewee_id])
+    
+    __table_args__ = (
+        UniqueConstraint('review_cycle_id', 'reviewee_id', name='uq_leaderboard_cycle_reviewee'),
+        Index('ix_leaderboard_cycle_score', 'review_cycle_id', 'composite_score', 'reviewee_id'),
+        Index('ix_leaderboard_cycle_dept_score', 'review_cycle_id', 'department', 'composite_score', 'reviewee_id'),
+    )
+
+class LeaderboardState(Base):
+    __tablename__ = 'leaderboard_states'
+    
+    id = Column(Integer, primary_key=True)
+    review_cycle_id = Column(Integer, ForeignKey('review_cycles.id'), unique=True, nullable=False)
+    weights_key = Column(String(100))  # LEADERBOARD_WEIGHTS used for every entry of the cycle
+    is_stale = Column(Boolean, default=False)  # entries must be rebuilt before the next read
+    rebuilt_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class UserSession(Base):
+    __tablename__ = 'user_sessions'
+    
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), unique=True, nullable=False)  # sha256 of the browser token
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_seen_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, default=datetime.now)
+    
+    user = relationship('User')
+
+class TagMapping(Base):
+    __tablename__ = 'tag_mappings'
+    
+    id = Column(Integer, primary_key=True)
+    raw_tag = Column(String(255), unique=True, nullable=False)  # tag as typed in reviews, after strip()
+    normalized = Column(String(255), nullable=False)  # case/accent/punctuation folded
+    canonical = Column(String(255), nullable=False, index=True)  # label shown in reports
+    is_override = Column(Boolean, default=False)  # set by admin, never recomputed
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True)  # polled by other app replicas
+
 def init_db(database_url):
     engine = create_engine(database_url)
     Base.metadata.create_all(engine)
@@ -1,7 +1,9 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func
 from models import User, Review, ReviewCycle
-from typing import List, Dict, Any
+from leaderboard import get_leaderboard
+from tags import count_canonical_tags
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 
 def get_department_scores(db: Session, review_cycle_id: int) -> List[Dict[str, Any]]:
@@ -30,33 +32,10 @@ def get_department_scores(db: Session, review_cycle_id: int) -> List[Dict[str, A
         for r in results
     ]
 
-def get_top_performers(db: Session, review_cycle_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    """Lấy danh sách nhân viên có điểm cao nhất"""
-    results = db.query(
-        User.full_name,
-        User.department,
-        func.avg(Review.performance_score).label('avg_performance'),
-        func.avg(Review.leadership_score).label('avg_leadership'),
-        func.avg(Review.teamwork_score).label('avg_teamwork'),
-        func.avg(Review.innovation_score).label('avg_innovation')
-    ).join(Review, Review.reviewee_id == User.id)\
-    .filter(Review.review_cycle_id == review_cycle_id)\
-    .group_by(User.id, User.full_name, User.department)\
-    .order_by(desc(func.avg(Review.performance_score)))\
-    .limit(limit)\
-    .all()
-    
-    return [
-        {
-            'full_name': r.full_name,
-            'department': r.department,
-            'avg_performance': float(r.avg_performance or 0),
-            'avg_leadership': float(r.avg_leadership or 0),
-            'avg_teamwork': float(r.avg_teamwork or 0),
-            'avg_innovation': float(r.avg_innovation or 0)
-        }
-        for r in results
-    ]
+def get_top_performers(db: Session, review_cycle_id: int, limit: int = 10,
+                       department: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Lấy danh sách nhân viên có điểm cao nhất (đọc từ bảng xếp hạng đã tính sẵn)"""
+    return get_leaderboard(db, review_cycle_id, limit=limit, department=department)
 
 def get_review_completion_status(db: Session, review_cycle_id: int) -> Dict[str, Any]:
     """Lấy thống kê về tiến độ đánh giá"""
@@ -84,47 +63,25 @@ def get_review_completion_status(db: Session, review_cycle_id: int) -> Dict[str,
     }
 
 def get_training_recommendations(db: Session, review_cycle_id: int) -> List[Dict[str, Any]]:
-    """Lấy các đề xuất đào tạo phổ biến"""
-    reviews = db.query(Review)\
+    """Lấy các đề xuất đào tạo phổ biến (gộp các cách viết khác nhau của cùng một đề xuất)"""
+    values = db.query(Review.training_recommendations)\
         .filter(Review.review_cycle_id == review_cycle_id)\
         .filter(Review.training_recommendations.isnot(None))\
         .all()
     
-    recommendations = {}
-    for review in reviews:
-        if review.training_recommendations:
-            for rec in review.training_recommendations.split(','):
-                rec = rec.strip()
-                if rec:
-                    recommendations[rec] = recommendations.get(rec, 0) + 1
-    
-    sorted_recommendations = sorted(
-        [{'recommendation': k, 'count': v} for k, v in recommendations.items()],
-        key=lambda x: x['count'],
-        reverse=True
-    )
-    
-    return sorted_recommendations
+    return [
+        {'recommendation': r['tag'], 'count': r['count']}
+        for r in count_canonical_tags(db, (v.training_recommendations for v in values))
+    ]
 
 def get_improvement_areas(db: Session, review_cycle_id: int) -> List[Dict[str, Any]]:
-    """Lấy các lĩnh vực cần cải thiện phổ biến"""
-    reviews = db.query(Review)\
+    """Lấy các lĩnh vực cần cải thiện phổ biến (gộp các cách viết khác nhau của cùng một lĩnh vực)"""
+    values = db.query(Review.areas_for_improvement)\
         .filter(Review.review_cycle_id == review_cycle_id)\
         .filter(Review.areas_for_improvement.isnot(None))\
         .all()
     
-    areas = {}
-    for review in reviews:
-        if review.areas_for_improvement:
-            for area in review.areas_for_improvement.split(','):
-                area = area.strip()
-                if area:
-                    areas[area] = areas.get(area, 0) + 1
-    
-    sorted_areas = sorted(
-        [{'area': k, 'count': v} for k, v in areas.items()],
-        key=lambda x: x['count'],
-        reverse=True
-    )
-    
-    return sorted_areas 
\ No newline at end of file
+    return [
+        {'area': r['tag'], 'count': r['count']}
+        for r in count_canonical_tags(db, (v.areas_for_improvement for v in values))
+    ]
@@ -0,0 +1,469 @@
+import re
+import math
+import zlib
+import queue
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.exc import IntegrityError
+from models import Review, TagMapping
+from typing import List, Dict, Any, Iterable, Optional
+
+NGRAM_SIZE = 3
+# Hai từ khóa được gộp khi hệ số Dice trên tập n-gram đạt ngưỡng này
+SIMILARITY_THRESHOLD = 0.7
+# Từ khóa quá ngắn chỉ được gộp khi trùng khớp sau chuẩn hóa
+MIN_NGRAMS = 6
+# N-gram xuất hiện ở quá nhiều từ khóa bị bỏ qua khi tìm ứng viên (stop-list), để thời gian
+# tìm kiếm không tăng theo số nhãn khi các từ khóa dùng chung nhiều âm tiết
+MAX_GRAM_FREQUENCY = 256
+# Mỗi lần dùng cache, đọc lại các dòng tag_mappings đổi từ lúc bắt đầu lần đồng bộ trước (do
+# replica khác ghi) lùi thêm khoảng này, bù cho lệch đồng hồ giữa các máy, updated_at chỉ chính
+# xác tới giây và transaction commit muộn
+TAG_SYNC_MARGIN_SECONDS = 10
+# Báo cáo tự phân cụm ngay tối đa chừng này từ khóa mới; nhiều hơn thì phân cụm nền
+INLINE_CLUSTER_LIMIT = 1000
+# Các trường của Review chứa từ khóa phân tách bằng dấu phẩy
+TAG_FIELDS = ('training_recommendations', 'areas_for_improvement')
+# Tiền tố chung chung bị bỏ khi chuẩn hóa: "Kỹ năng giao tiếp" -> "giao tiep"
+FILLER_PREFIXES = ('ky nang', 'kien thuc', 'khoa hoc', 'dao tao', 'cai thien')
+
+logger = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+def normalize_tag(tag: str) -> str:
+    """Chuẩn hóa từ khóa: bỏ dấu tiếng Việt, chữ thường, bỏ dấu câu và khoảng trắng thừa"""
+    text = tag.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = ' '.join(_PUNCT_RE.sub(' ', text.casefold()).split())
+    for prefix in FILLER_PREFIXES:
+        if text.startswith(prefix + ' '):
+            text = text[len(prefix) + 1:]
+            break
+    return text
+
+def _diacritic_count(tag: str) -> int:
+    return sum(1 for c in unicodedata.normalize('NFD', tag) if unicodedata.combining(c)) + tag.lower().count('đ')
+
+def tag_ngrams(normalized: str) -> frozenset:
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+def _prefix_size(size: int, threshold: float) -> int:
+    # Dice >= t cần ít nhất t/(2-t)*size n-gram chung, nên mọi cặp đủ giống đều
+    # chung ít nhất một n-gram trong tiền tố có độ dài này
+    return size - max(1, math.ceil(threshold / (2 - threshold) * size - 1e-9)) + 1
+
+class TagIndex:
+    """Chỉ mục n-gram của các nhãn chuẩn, dùng để gộp từ khóa gần giống mà không so sánh từng cặp.
+
+    Dùng prefix filtering: chỉ các nhãn có chung ít nhất một n-gram trong phần
+    tiền tố với từ khóa mới được tính độ tương đồng. N-gram được sắp từ hiếm đến
+    phổ biến theo tần suất chụp lúc dựng chỉ mục; thứ tự này giữ cố định suốt
+    vòng đời chỉ mục để các tiền tố luôn nhất quán khi thêm từ khóa mới.
+
+    Chỉ mục được cập nhật theo từng dòng tag_mappings (apply/discard), nên thay đổi
+    của admin hay của replica khác không buộc phải dựng lại từ đầu.
+    """
+
+    def __init__(self, gram_frequencies: Optional[Dict[str, int]] = None,
+                 threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.gram_frequencies = dict(gram_frequencies or {})
+        self.stop_grams = {gram for gram, count in self.gram_frequencies.items() if count > MAX_GRAM_FREQUENCY}
+        self.rows = {}  # raw_tag -> (normalized, canonical, is_override)
+        self.by_normalized = {}  # normalized -> canonical
+        self.representatives = []  # [(canonical, ngrams, len(ngrams))], None khi đã bỏ
+        self.postings = {}  # ngram -> [representative index], chỉ n-gram thuộc tiền tố
+        self._owners = {}  # normalized -> {raw_tag} quyết định by_normalized[normalized]
+        self._representative_ids = {}  # raw_tag -> [representative index]
+
+    def _prefix(self, grams: frozenset) -> List[str]:
+        # Bỏ qua n-gram trong stop-list nhưng vẫn lấy đủ số n-gram của tiền tố: hai nhãn đủ
+        # giống nhau vẫn chung ít nhất một n-gram trong phần còn lại
+        size = _prefix_size(len(grams), self.threshold)
+        usable = [gram for gram in grams if gram not in self.stop_grams]
+        return sorted(usable, key=self._gram_order)[:size]
+
+    def _gram_order(self, gram: str):
+        return (self.gram_frequencies.get(gram, 0), zlib.crc32(gram.encode('utf-8')))
+
+    def _add_representative(self, normalized: str, canonical: str) -> Optional[int]:
+        grams = tag_ngrams(normalized)
+        if len(grams) < MIN_NGRAMS:
+            return None
+        idx = len(self.representatives)
+        self.representatives.append((canonical, grams, len(grams)))
+        for gram in self._prefix(grams):
+            self.postings.setdefault(gram, []).append(idx)
+        return idx
+
+    def _keys(self, raw_tag: str) -> List[str]:
+        normalized, canonical, is_override = self.rows[raw_tag]
+        # Biến thể mới của từ khóa và của nhãn do admin đặt cũng được gộp vào nhãn đó
+        return [normalized, normalize_tag(canonical)] if is_override else [normalized]
+
+    def _refresh(self, normalized: str):
+        owners = self._owners.get(normalized)
+        if not owners:
+            self.by_normalized.pop(normalized, None)
+            return
+        # Ánh xạ của admin được ưu tiên, sau đó tới từ khóa đại diện của cụm
+        def rank(raw_tag):
+            _, canonical, is_override = self.rows[raw_tag]
+            return (not is_override, raw_tag != canonical, raw_tag)
+        self.by_normalized[normalized] = self.rows[min(owners, key=rank)][1]
+
+    def apply(self, raw_tag: str, normalized: str, canonical: str, is_override: bool = False):
+        """Thêm hoặc cập nhật một dòng tag_mappings"""
+        if self.rows.get(raw_tag) == (normalized, canonical, is_override):
+            return
+        self.discard(raw_tag)
+        self.rows[raw_tag] = (normalized, canonical, is_override)
+        keys = self._keys(raw_tag)
+        if is_override or raw_tag == canonical:
+            ids = [self._add_representative(key, canonical) for key in keys]
+            self._representative_ids[raw_tag] = [idx for idx in ids if idx is not None]
+        for key in keys:
+            self._owners.setdefault(key, set()).add(raw_tag)
+            self._refresh(key)
+
+    def discard(self, raw_tag: str):
+        """Bỏ một dòng khỏi chỉ mục (trước khi phân cụm lại nó)"""
+        if raw_tag not in self.rows:
+            return
+        keys = self._keys(raw_tag)
+        del self.rows[raw_tag]
+        for idx in self._representative_ids.pop(raw_tag, ()):
+            self.representatives[idx] = None
+        for key in keys:
+            owners = self._owners.get(key)
+            if owners is not None:
+                owners.discard(raw_tag)
+                if not owners:
+                    del self._owners[key]
+            self._refresh(key)
+
+    def find(self, normalized: str) -> Optional[str]:
+        """Nhãn chuẩn phù hợp nhất cho một từ khóa đã chuẩn hóa, None nếu không có"""
+        if normalized in self.by_normalized:
+            return self.by_normalized[normalized]
+
+        grams = tag_ngrams(normalized)
+        size = len(grams)
+        if size < MIN_NGRAMS:
+            return None
+
+        candidates = set()
+        for gram in self._prefix(grams):
+            candidates.update(self.postings.get(gram, ()))
+
+        threshold = self.threshold
+        representatives = self.representatives
+        min_size = threshold / (2 - threshold) * size
+        max_size = (2 - threshold) / threshold * size
+        best, best_score = None, 0.0
+        for idx in candidates:
+            representative = representatives[idx]
+            if representative is None:
+                continue
+            canonical, rep_grams, rep_size = representative
+            if rep_size < min_size or rep_size > max_size:
+                continue
+            score = 2 * len(grams & rep_grams) / (size + rep_size)
+            if score >= threshold and score > best_score:
+                best, best_score = canonical, score
+        return best
+
+    def assign(self, raw_tag: str, normalized: str) -> str:
+        """Gán từ khóa vào cụm sẵn có hoặc tạo cụm mới với chính nó làm nhãn chuẩn"""
+        canonical = self.find(normalized) or raw_tag
+        self.apply(raw_tag, normalized, canonical)
+        return canonical
+
+# Bản sao tag_mappings trong tiến trình: raw_tag -> (normalized, canonical, is_override).
+# _sync đọc các dòng vừa đổi trong CSDL (của tiến trình này hay replica khác) vào _rows và
+# đưa vào _pending; chỉ mục chỉ được dùng và sửa bởi luồng giữ _cluster_lock, luồng đó áp
+# _pending vào chỉ mục trước khi phân cụm. _lock chỉ giữ trong lúc đọc/ghi các biến dưới đây,
+# nên báo cáo có từ khóa đã biết không phải chờ việc phân cụm.
+_rows = {}
+_row_times = {}  # raw_tag -> updated_at của dòng đã đọc
+_pending = []  # [(raw_tag, normalized, canonical, is_override)] chưa áp vào chỉ mục
+_synced_at = None  # thời điểm bắt đầu lần đồng bộ gần nhất
+_generation = 0
+_index = None
+_index_built_size = 0
+_scheduled = set()  # từ khóa đang chờ phân cụm nền
+_queue = queue.Queue()
+_worker = None
+_lock = threading.Lock()
+_cluster_lock = threading.Lock()
+
+def invalidate_tag_cache():
+    """Bỏ toàn bộ cache; lần dùng sau đọc lại tag_mappings và dựng lại chỉ mục"""
+    global _index, _synced_at, _generation
+    with _lock:
+        _rows.clear()
+        _row_times.clear()
+        _pending.clear()
+        _index = None
+        _synced_at = None
+        _generation += 1
+
+def _sync(db: Session):
+    """Đọc các dòng tag_mappings thêm hoặc sửa từ lần đồng bộ trước (một truy vấn theo chỉ mục updated_at)"""
+    global _synced_at
+    started = datetime.now()
+    with _lock:
+        since = _synced_at
+        generation = _generation
+    query = db.query(TagMapping.raw_tag, TagMapping.normalized, TagMapping.canonical,
+                     TagMapping.is_override, TagMapping.updated_at)
+    if since is not None:
+        query = query.filter(TagMapping.updated_at >= since - timedelta(seconds=TAG_SYNC_MARGIN_SECONDS))
+    rows = query.all()
+    with _lock:
+        if generation != _generation:
+            return
+        for row in rows:
+            seen_at = _row_times.get(row.raw_tag)
+            if seen_at is not None and row.updated_at is not None and row.updated_at < seen_at:
+                continue  # một lần đồng bộ khác đã đọc bản mới hơn
+            value = (row.normalized, row.canonical, bool(row.is_override))
+            _row_times[row.raw_tag] = row.updated_at
+            if _rows.get(row.raw_tag) != value:
+                _rows[row.raw_tag] = value
+                _pending.append((row.raw_tag,) + value)
+        _synced_at = max(started, since) if since is not None else started
+
+def _ensure_index(new_tags: Iterable[str] = ()) -> TagIndex:
+    """Chỉ mục đã áp mọi thay đổi đã đọc; chỉ gọi khi giữ _cluster_lock"""
+    global _index, _index_built_size
+    with _lock:
+        # Thứ tự n-gram chụp lúc dựng; dựng lại khi số từ khóa đã gấp đôi để thứ tự không cũ
+        rebuild = _index is None or len(_rows) > 2 * max(_index_built_size, 1000)
+        pending = list(_pending)
+        _pending.clear()
+        rows = dict(_rows) if rebuild else None
+    if not rebuild:
+        for row in pending:
+            _index.apply(*row)
+        return _index
+
+    gram_frequencies = Counter()
+    for normalized in {row[0] for row in rows.values()} | {normalize_tag(tag) for tag in new_tags}:
+        gram_frequencies.update(tag_ngrams(normalized))
+    index = TagIndex(gram_frequencies)
+    for raw_tag, row in rows.items():
+        index.apply(raw_tag, *row)
+    _index, _index_built_size = index, len(rows)
+    return index
+
+def _cluster(db: Session, tag_counts: Dict[str, int]):
+    """Phân cụm các từ khóa chưa có trong tag_mappings và lưu lại; chỉ gọi khi giữ _cluster_lock"""
+    _sync(db)
+    with _lock:
+        new_tags = [tag for tag in tag_counts if tag not in _rows]
+    if not new_tags:
+        return
+    index = _ensure_index(new_tags)
+    # Cách viết phổ biến nhất làm nhãn chuẩn; khi bằng nhau ưu tiên từ ngắn gọn, viết đủ dấu
+    new_tags.sort(key=lambda tag: (-tag_counts[tag], len(tag), -_diacritic_count(tag), tag))
+    new_rows = []
+    for tag in new_tags:
+        normalized = normalize_tag(tag)
+        canonical = index.assign(tag, normalized)
+        new_rows.append(TagMapping(raw_tag=tag, normalized=normalized, canonical=canonical))
+    try:
+        db.add_all(new_rows)
+        db.commit()
+    except IntegrityError:
+        # Một replica khác vừa lưu cùng từ khóa: bản đã lưu được đọc về ở lần đồng bộ sau
+        db.rollback()
+    _sync(db)
+
+def _cluster_worker():
+    while True:
+        bind, tag_counts = _queue.get()
+        db = Session(bind=bind)
+        try:
+            with _cluster_lock:
+                _cluster(db, tag_counts)
+        except Exception:
+            logger.exception("Phân cụm từ khóa thất bại")
+        finally:
+            db.close()
+            with _lock:
+                _scheduled.difference_update(tag_counts)
+
+def schedule_clustering(bind, tag_counts: Dict[str, int]):
+    """Phân cụm từ khóa ở luồng nền (bind: engine của CSDL)"""
+    global _worker
+    with _lock:
+        tag_counts = {tag: count for tag, count in tag_counts.items()
+                      if tag not in _rows and tag not in _scheduled}
+        if not tag_counts:
+            return
+        _scheduled.update(tag_counts)
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_cluster_worker, name="tag-clustering", daemon=True)
+            _worker.start()
+    _queue.put((bind, tag_counts))
+
+def clustering_pending() -> bool:
+    """Còn từ khóa đang được phân cụm nền (báo cáo đang gộp tạm theo dạng chuẩn hóa)"""
+    with _lock:
+        return bool(_scheduled)
+
+def canonicalize_tags(db: Session, tag_counts: Dict[str, int]) -> Dict[str, str]:
+    """Ánh xạ từ khóa gốc sang nhãn chuẩn.
+
+    Từ khóa thường đã được phân cụm khi đánh giá được lưu. Số ít từ khóa còn thiếu được phân
+    cụm ngay; nếu nhiều (dữ liệu cũ, ghi hàng loạt) hoặc chỉ mục đang bận, chúng được phân cụm
+    nền và tạm thời gộp theo dạng chuẩn hóa để trang báo cáo không phải chờ.
+    """
+    _sync(db)
+    with _lock:
+        unknown = {tag: count for tag, count in tag_counts.items() if tag not in _rows}
+        cheap = len(unknown) <= INLINE_CLUSTER_LIMIT and (_index is not None or len(_rows) <= INLINE_CLUSTER_LIMIT)
+    if unknown and cheap and _cluster_lock.acquire(blocking=False):
+        try:
+            _cluster(db, unknown)
+        finally:
+            _cluster_lock.release()
+    elif unknown:
+        schedule_clustering(db.get_bind(TagMapping.__mapper__), unknown)
+
+    with _lock:
+        mapping = {tag: _rows[tag][1] for tag in tag_counts if tag in _rows}
+    provisional = {}
+    missing = [tag for tag in tag_counts if tag not in mapping]
+    for tag in sorted(missing, key=lambda tag: (-tag_counts[tag], len(tag), -_diacritic_count(tag), tag)):
+        mapping[tag] = provisional.setdefault(normalize_tag(tag), tag)
+    return mapping
+
+def split_tags(value: Optional[str]) -> List[str]:
+    """Tách chuỗi từ khóa phân tách bằng dấu phẩy"""
+    if not value:
+        return []
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+def count_canonical_tags(db: Session, values: Iterable[str]) -> List[Dict[str, Any]]:
+    """Đếm từ khóa (phân tách bằng dấu phẩy) theo nhãn chuẩn, sắp xếp giảm dần"""
+    raw_counts = Counter()
+    for value in values:
+        raw_counts.update(split_tags(value))
+
+    mapping = canonicalize_tags(db, raw_counts)
+    counts = Counter()
+    for tag, count in raw_counts.items():
+        counts[mapping[tag]] += count
+    return [{'tag': tag, 'count': count} for tag, count in counts.most_common()]
+
+# Từ khóa trong đánh giá vừa lưu được phân cụm nền ngay sau commit, nên báo cáo HR
+# thường chỉ cần đọc ánh xạ đã có
+_NEW_TAGS_KEY = 'tags_new'
+
+@event.listens_for(Session, 'before_flush')
+def _collect_review_tags(session, flush_context, instances):
+    new_tags = session.info.setdefault(_NEW_TAGS_KEY, Counter())
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Review):
+            continue
+        for field in TAG_FIELDS:
+            if obj in session.new or attributes.get_history(obj, field).has_changes():
+                new_tags.update(split_tags(getattr(obj, field)))
+
+@event.listens_for(Session, 'after_commit')
+def _schedule_review_tags(session):
+    new_tags = session.info.pop(_NEW_TAGS_KEY, None)
+    if new_tags:
+        schedule_clustering(session.get_bind(TagMapping.__mapper__), new_tags)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_review_tags(session):
+    session.info.pop(_NEW_TAGS_KEY, None)
+
+def get_tag_overrides(db: Session) -> List[Dict[str, Any]]:
+    """Danh sách ánh xạ do admin đặt"""
+    rows = db.query(TagMapping)\
+        .filter(TagMapping.is_override.is_(True))\
+        .order_by(TagMapping.canonical, TagMapping.raw_tag)\
+        .all()
+    return [{'raw_tag': r.raw_tag, 'canonical': r.canonical} for r in rows]
+
+def set_tag_override(db: Session, raw_tag: str, canonical: str) -> TagMapping:
+    """Admin chỉ định nhãn chuẩn cho một từ khóa.
+
+    Nếu từ khóa đang là nhãn của một cụm thì cả cụm được đổi nhãn theo, thay vì tách riêng nó ra.
+    """
+    raw_tag = raw_tag.strip()
+    canonical = canonical.strip()
+    row = db.query(TagMapping).filter(TagMapping.raw_tag == raw_tag).first()
+    if row is None:
+        row = TagMapping(raw_tag=raw_tag, normalized=normalize_tag(raw_tag))
+        db.add(row)
+    elif row.canonical != canonical and _owns_label(db, row):
+        db.query(TagMapping)\
+            .filter(TagMapping.canonical == row.canonical)\
+            .filter(TagMapping.is_override.isnot(True))\
+            .update({TagMapping.canonical: canonical}, synchronize_session=False)
+    row.canonical = canonical
+    row.is_override = True
+    db.commit()
+    _sync(db)
+    return row
+
+def _owns_label(db: Session, row: TagMapping) -> bool:
+    # Từ khóa là đại diện của cụm, hoặc là ánh xạ của admin duy nhất tạo ra nhãn này
+    if row.raw_tag == row.canonical:
+        return True
+    if not row.is_override:
+        return False
+    shared = db.query(TagMapping.id)\
+        .filter(TagMapping.canonical == row.canonical)\
+        .filter(TagMapping.id != row.id)\
+        .filter((TagMapping.is_override.is_(True)) | (TagMapping.raw_tag == row.canonical))\
+        .first()
+    return shared is None
+
+def delete_tag_override(db: Session, raw_tag: str):
+    """Xóa ánh xạ của admin; từ khóa (và các biến thể đã gộp theo nó) được phân cụm lại ngay.
+
+    Các dòng được cập nhật tại chỗ thay vì xóa, để replica khác thấy thay đổi qua updated_at.
+    """
+    row = db.query(TagMapping)\
+        .filter(TagMapping.raw_tag == raw_tag)\
+        .filter(TagMapping.is_override.is_(True))\
+        .first()
+    if row is None:
+        return
+    rows = [row]
+    still_used = db.query(TagMapping.id)\
+        .filter(TagMapping.canonical == row.canonical)\
+        .filter(TagMapping.is_override.is_(True))\
+        .filter(TagMapping.id != row.id)\
+        .first()
+    if still_used is None:
+        rows += db.query(TagMapping)\
+            .filter(TagMapping.canonical == row.canonical)\
+            .filter(TagMapping.raw_tag != row.canonical)\
+            .filter(TagMapping.id != row.id)\
+            .all()
+
+    with _cluster_lock:
+        _sync(db)
+        index = _ensure_index()
+        for r in rows:
+            index.discard(r.raw_tag)
+        for r in sorted(rows, key=lambda r: r.id):
+            r.canonical = index.assign(r.raw_tag, r.normalized)
+            r.is_override = False
+        db.commit()
+        _sync(db)